@@ -6,6 +6,7 @@ import sys
 import argparse
 import itertools
 import random
+from ward_kernels import blocks, R0_draws, R0_days
 
 #Argparse
 parser=argparse.ArgumentParser(description="Simulation of single infection in ward \n \n Author Tom Crellen (tomcrellen@gmail.com) MORU Postdoc")
@@ -18,6 +19,12 @@ parser.add_argument('-D', '--distribution', default='log-normal', required=False
 parser.add_argument('-A', '--average-stay', default=5, required=False, dest="stay", metavar="<average stay length>",type=int,help="depending on distribution, median (log-normal, uniform), mean (exponential) or scale (gamma, weibull),  integer, default=5")
 parser.add_argument('-P2', '--parameter2', default=2, required=False, dest="param2", metavar="<second parameter>",type=int,help="Second parameter, variance for log-normal and shape parameter for weibull and gamma, integer, default=2")
 parser.add_argument('--data', default=None, required=False, dest="data", metavar="<file of stay lengths>",help="If data specified with -D, path to file where each line is length of stay (days)")
+parser.add_argument('-K', '--kernel', default='homogeneous', required=False, dest="kernel", metavar="<transmission kernel>",type=str,help="Spatial transmission kernel over bed coordinates, homogeneous (default, all beds mix equally), exponential or step")
+parser.add_argument('-RD', '--radius', default=1.5, required=False, dest="radius", metavar="<cutoff radius>",type=float,help="Cutoff radius (in bed spacings) beyond which no transmission occurs, exponential and step kernels only, float, default=1.5")
+parser.add_argument('-S', '--scale', default=1.0, required=False, dest="scale", metavar="<kernel scale>",type=float,help="Length scale (in bed spacings) of exponential kernel decay beyond adjacent beds, float, default=1.0")
+parser.add_argument('-E', '--engine', default='python', required=False, dest="engine", metavar="<simulation engine>",type=str,help="Simulation engine, python (default, object model) or array (typed array kernel, JIT-compiled with Numba if installed and NumPy otherwise, homogeneous kernel only)")
+parser.add_argument('-B', '--block', default=100, required=False, dest="block", metavar="<replicate block>",type=int,help="Number of replicates advanced together by the array engine, integer, default=100")
+parser.add_argument('--seed', default=None, required=False, dest="seed", metavar="<random seed>",type=int,help="Seed for the random number generator, integer, default=random")
 args = parser.parse_args()
 
 #Command line args- assumes default value if not specified
@@ -30,6 +37,13 @@ average_stay = args.stay
 param2 = args.param2
 data = args.data
 replicates = args.replicates
+kernel = args.kernel.lower()
+radius = args.radius
+scale = args.scale
+engine = args.engine.lower()
+block_size = args.block
+if args.seed != None:
+        numpy.random.seed(args.seed)
 
 #Check list of input stay lengths in data
 data_list = []
@@ -41,7 +55,7 @@ if data != None:
 
 #Ward Class
 class R0:
-        def __init__(self, height, width, n_days, risk, distribution, average_stay, param2, data_list, replicate):
+        def __init__(self, height, width, n_days, risk, distribution, average_stay, param2, data_list, replicate, kernel="homogeneous", radius=1.5, scale=1.0, index=None):
                 self.height = height
                 self.width = width
                 self.n_days = n_days
@@ -53,6 +67,12 @@ class R0:
                 self.replicate = replicate
                 self.bed_infected = []
                 self.transmission = []
+                self.kernel = kernel
+                self.radius = radius
+                self.scale = scale
+                #sparse neighbour index of the spatial kernel (bed_index, indptr, indices, weights), shared by all replicates
+                #built in populate if not given
+                self.index = index
 
     #Function to populate the ward with beds of given coordinates (n= width*height)
         def populate(self):
@@ -68,9 +88,72 @@ class R0:
                 self.beds[self.ward[0]] = ["index", int(discharge[0])]
                 self.bed_infected.append(self.ward[0])
                 self.bed_uninfected = self.ward[1:] 
+                if self.kernel != "homogeneous":
+                        if self.index is None:
+                                self.index = (dict((bed, q) for q, bed in enumerate(self.ward)),) + neighbours(self.ward, self.kernel, self.radius, self.scale)
+                        self.bed_index, self.indptr, self.indices, self.weights = self.index
+                        #infected mask and beds discharged on each day, so the daily cost follows infected beds and discharges
+                        self.infected = numpy.zeros(len(self.ward), dtype=bool)
+                        self.infected[0] = True
+                        self.n_infected = 1
+                        self.discharge_days = {}
+                        for q in range(len(self.ward)):
+                                self.discharge_days.setdefault(max(self.beds[self.ward[q]][1], 0), []).append(q)
+
+        #Spatial transmission, each infector-neighbour pair within the cutoff radius is an independent trial
+        def spatial_transmission(self):
+                infectors = numpy.flatnonzero(self.infected)
+                #expand infectors into (infector, neighbour) pairs using the CSR index
+                starts = self.indptr[infectors]
+                counts = self.indptr[infectors+1] - starts
+                offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+                pairs = numpy.repeat(starts, counts) + offsets
+                pair_infectors = numpy.repeat(infectors, counts)
+                targets = self.indices[pairs]
+                #bernoulli trial for each pair, only susceptible neighbours can be infected
+                success = (numpy.random.random(len(pairs)) < self.risk*self.weights[pairs]) & ~self.infected[targets]
+                #susceptible infected by more than one neighbour, attribute to first successful infector
+                infected, first = numpy.unique(targets[success], return_index=True)
+                self.infected[infected] = True
+                self.n_infected += len(infected)
+                transmission_bed_coords = [self.ward[c] for c in infected]
+                infector_bed_coords = [self.ward[f] for f in pair_infectors[success][first]]
+                return transmission_bed_coords, infector_bed_coords
         
+        #Run simulation with a spatial kernel, ward state is kept in arrays indexed by bed
+        def simulate_spatial(self):
+                for day in range(self.n_days):
+                        if day != 0:
+                                transmission_bed_coords, infector_bed_coords = self.spatial_transmission()
+                                #get IDs of infected patients and of bed-infectors from the bed dict
+                                transmission_bed_IDs = [self.beds[d][0] for d in transmission_bed_coords]
+                                infector_ID = [self.beds[g][0] for g in infector_bed_coords]
+                                #Zip lists - to give transmission/ contact pairs
+                                self.transmission.append(zip(infector_ID, transmission_bed_IDs))
+
+                        #Print output
+                        prop_infected = float(self.n_infected)/float(len(self.ward))
+                        print '{} {} {}'.format(self.replicate, day, prop_infected)
+
+                        #terminate loop if no more infected patients
+                        if self.n_infected == 0:
+                                break
+
+                        #Remove patients with discharge date == date, replaced by uninfected patients
+                        remove = numpy.array(self.discharge_days.pop(day, []), dtype=int)
+                        self.n_infected -= int(self.infected[remove].sum())
+                        self.infected[remove] = False
+                        #Sample discharge date from distribution
+                        discharge = numpy.random.choice(self.stay_distribution, size=len(remove))
+                        for spare in range(len(remove)):
+                                date = int(discharge[spare])+day
+                                self.beds[self.ward[remove[spare]]] = [str(day)+"."+str(spare), date]
+                                self.discharge_days.setdefault(max(date, day+1), []).append(remove[spare])
+
         #Run simulation
         def simulate(self):
+                if self.kernel != "homogeneous":
+                        return self.simulate_spatial()
                 for day in range(self.n_days):
                         if day != 0:
                                 n_infectors = len(self.bed_infected)
@@ -80,10 +163,10 @@ class R0:
                                 transmission_events = [j for j, event in enumerate(transmission_array) if event <= n_infectors] 
                                 #get bed coordinates of successful transmission events
                                 transmission_bed_coords = [self.bed_uninfected[c] for c in transmission_events]
-                                #get IDs of infected patients from the bed dict
-                                transmission_bed_IDs = [self.beds[d][0] for d in transmission_bed_coords]
                                 #get bed_coords of infectors
                                 infector_bed_coords = [self.bed_infected[f-1] for f in transmission_array if f <= n_infectors]
+                                #get IDs of infected patients from the bed dict
+                                transmission_bed_IDs = [self.beds[d][0] for d in transmission_bed_coords]
                                 #get ID of bed-infectors
                                 infector_ID = [self.beds[g][0] for g in infector_bed_coords]
                                 #Zip lists - to give transmission/ contact pairs
@@ -135,9 +218,56 @@ def dist(d, average, data, param2, size):
         else:
                 raise ValueError("Distribution must be log-normal, gamma, exponential, weibull, uniform or data")
 
+#Sparse neighbour index of beds within cutoff radius, CSR arrays (indptr, indices, kernel weights)
+def neighbours(ward, kernel, radius, scale):
+        if kernel not in ("exponential", "step"):
+                raise ValueError("Kernel must be homogeneous, exponential or step")
+        #offsets on the bed grid within the cutoff radius, computed once for all beds
+        r = int(radius)
+        offsets = [(dx, dy) for dx in range(-r, r+1) for dy in range(-r, r+1) if 0 < dx**2+dy**2 <= radius**2]
+        bed_index = dict((bed, q) for q, bed in enumerate(ward))
+        indptr = [0]
+        indices = []
+        weights = []
+        for (x, y) in ward:
+                for (dx, dy) in offsets:
+                        q = bed_index.get((x+dx, y+dy))
+                        if q is not None:
+                                indices.append(q)
+                                #weight relative to adjacent beds (distance 1)
+                                if kernel == "exponential":
+                                        weights.append(min(1.0, numpy.exp(-(numpy.sqrt(dx**2+dy**2)-1)/scale)))
+                                else:
+                                        weights.append(1.0)
+                indptr.append(len(indices))
+        return numpy.array(indptr, dtype=int), numpy.array(indices, dtype=int), numpy.array(weights)
+
 #Run simulation
-for rep in range(1, replicates+1):
-        name = "run."+str(rep)
-        name = R0(height, width, n_days, risk, distribution, average_stay, param2, data_list, rep)
-        name.populate()
-        name.simulate()
+if engine == "array":
+        if kernel != "homogeneous":
+                raise ValueError("Array engine supports homogeneous kernel only")
+        n_beds = height*width
+        stay_distribution = dist(distribution, average_stay, data_list, param2, 100000)
+        rep = 1
+        #whole blocks of replicates run inside the array kernel
+        for block in blocks(replicates, block_size):
+                n_infected = R0_days(R0_draws(block, n_days, n_beds, stay_distribution), risk)
+                for r in range(block):
+                        for day in range(n_days):
+                                if n_infected[r, day] < 0:
+                                        break
+                                print '{} {} {}'.format(rep, day, float(n_infected[r, day])/float(n_beds))
+                        rep += 1
+elif engine == "python":
+        #neighbour index of the spatial kernel is built once, the ward layout is the same in every replicate
+        index = None
+        if kernel != "homogeneous":
+                ward = list(itertools.product(range(width), range(height)))
+                index = (dict((bed, q) for q, bed in enumerate(ward)),) + neighbours(ward, kernel, radius, scale)
+        for rep in range(1, replicates+1):
+                name = "run."+str(rep)
+                name = R0(height, width, n_days, risk, distribution, average_stay, param2, data_list, rep, kernel, radius, scale, index)
+                name.populate()
+                name.simulate()
+else:
+        raise ValueError("Engine must be python or array")
@@ -0,0 +1,45 @@
+#Scaling benchmark of hospital_simulation.py, wall time of the same random hospital network for increasing numbers of processes
+#with the same seed every run gives the same outcomes, which is checked against the run with one process
+
+import os
+import time
+import numpy
+import argparse
+import multiprocessing
+from hospital_simulation import hospital
+
+#Argparse
+parser = argparse.ArgumentParser(description="Scaling benchmark of hospital_simulation.py over a random network of ward units, prints wall time and speedup for each number of processes")
+parser.add_argument('-u', '--units', default=64, required=False, dest="units", metavar="", help="Number of ward units (64)")
+parser.add_argument('-d', '--degree', default=3, required=False, dest="degree", metavar="", help="Number of units each unit transfers to (3)")
+parser.add_argument('-t', '--transfer', default=0.02, required=False, dest="transfer", metavar="", help="Largest daily probability of transfer per patient on each link (0.02)")
+parser.add_argument('-i', '--iterations', default=365, required=False, dest="iter", metavar="", help="Number of model iterations / days (365)")
+parser.add_argument('-r', '--replicates', default=20, required=False, dest="replicates", metavar="", help="Number of model runs (20)")
+parser.add_argument('-j', '--processes', default="1,2,4,8", required=False, dest="processes", metavar="", help="Comma separated numbers of processes (1,2,4,8)")
+parser.add_argument('--seed', default=1, required=False, dest="seed", metavar="", help="Seed of the network and the simulation (1)")
+
+#Random network of units, beds 6-20, entry rate 1-5, trans0 and trans1 up to 0.1 and links to degree other units
+def network(units, degree, transfer, random):
+        config = [(int(random.randint(6, 21)), int(random.randint(1, 6)), random.uniform(0, 0.1), random.uniform(0, 0.1), 0.5, 0.4) for u in range(units)]
+        destinations = [sorted(random.choice([v for v in range(units) if v != u], min(degree, units-1), replace=False).tolist()) for u in range(units)]
+        rates = [list(random.uniform(0, transfer, len(destinations[u]))) for u in range(units)]
+        return config, destinations, rates
+
+if __name__ == "__main__":
+        args = parser.parse_args()
+        seed = int(args.seed)
+        config, destinations, rates = network(int(args.units), int(args.degree), float(args.transfer), numpy.random.RandomState(seed))
+        los_dist = []
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "parameters", "neonates.los.NU.txt"), 'r') as input_los:
+                for line in input_los:
+                        los_dist.append(int(line.split()[0].strip()))
+        print("processes" + "\t" + "seconds" + "\t" + "speedup" + "\t" + "same_outcomes" + "\t" + "cores")
+        reference = None
+        for processes in [int(value) for value in args.processes.split(",")]:
+                start = time.time()
+                results = hospital(config, destinations, rates, los_dist, int(args.iter)+1, int(args.replicates), processes, seed)
+                seconds = time.time()-start
+                outcomes = numpy.array([result[0] for result in results])
+                if reference == None:
+                        reference = (seconds, outcomes)
+                print(str(processes) + "\t" + str(round(seconds, 2)) + "\t" + str(round(reference[0]/seconds, 2)) + "\t" + str(bool(numpy.array_equal(outcomes, reference[1]))) + "\t" + str(multiprocessing.cpu_count()))
@@ -0,0 +1,189 @@
+#Hospital network of ward units linked by patient transfers, each unit is an array engine ward as in intervention_simulation.py
+#Units are partitioned across worker processes, which exchange only the transferring patients at each daily boundary,
+#directly between the processes of linked units
+#Transferred patients keep their discharge day, colonisation (sequence type) and intervention group
+
+import os
+import numpy
+import argparse
+import multiprocessing
+from ward_kernels import UNCOLON_ENTRY_0, UNCOLON_ENTRY_1, ward_state, ward_draws, ward_days
+
+#Argparse
+parser = argparse.ArgumentParser(description="Agent Based Model of K. pneumoniae transmission in a hospital network of ward units linked by patient transfers, with units sharded across processes")
+parser.add_argument('-w', '--wards', default=None, required=True, dest="wards", metavar="", help="Path to ward file, each line is one unit: beds, entry rate, trans0, trans1 and optionally prob (0.5) and importkleb (0.4), as in intervention_simulation.py")
+parser.add_argument('-T', '--transfers', default=None, required=False, dest="transfers", metavar="", help="Path to sparse transfer file, each line is from unit, to unit (numbered from 1 in ward file) and daily probability of transfer per patient (no transfers)")
+parser.add_argument('-l', '--lengthofstay', default=None, required=False, dest="los", metavar="", help="Path to file where each line is length of stay in days (parameters/neonates.los.NU.txt)")
+parser.add_argument('-i', '--iterations', default=365, required=False, dest="iter", metavar="", help="Number of model iterations / days (365)")
+parser.add_argument('-r', '--replicates', default=1, required=False, dest="replicates", metavar="", help="Number of model runs, advanced together in each unit (1)")
+parser.add_argument('-j', '--processes', default=1, required=False, dest="processes", metavar="", help="Number of worker processes the units are partitioned across (1)")
+parser.add_argument('--seed', default=None, required=False, dest="seed", metavar="", help="Seed for the random number generator, results do not depend on the number of processes (random)")
+
+#Assign units to processes, largest units first to the process with fewest beds
+def partition(beds, processes):
+        shards = [[] for k in range(min(processes, len(beds)))]
+        load = [0]*len(shards)
+        for u in sorted(range(len(beds)), key=lambda u: -beds[u]):
+                k = load.index(min(load))
+                shards[k].append(u)
+                load[k] += beds[u]
+        return shards
+
+#Exchange one message with each partner shard, partners in ascending order and the lower numbered shard sends first,
+#so the smallest pair not yet exchanged can always proceed and blocking sends cannot deadlock
+def exchange(k, connections, messages):
+        received = {}
+        for j in sorted(connections):
+                if k < j:
+                        connections[j].send(messages[j])
+                        received[j] = connections[j].recv()
+                else:
+                        received[j] = connections[j].recv()
+                        connections[j].send(messages[j])
+        return received
+
+#Worker process, advances its units one day at a time and exchanges transferring patients directly with the shards of linked units
+#each unit decides which transfers in to accept from its own free beds and random stream, so results do not depend on the partition
+def shard(k, connection, connections, owner, units, config, destinations, rates, los_dist, n_iterations, replicates, seed):
+        states = dict((u, ward_state(replicates, config[u][0])) for u in units)
+        transfers_in = dict((u, numpy.zeros(replicates, dtype=numpy.int64)) for u in units)
+        #uncolonised transfers in of each group, counted in the entry denominator of the receiving unit
+        uncolonised_in = dict((u, numpy.zeros((replicates, 2), dtype=numpy.int64)) for u in units)
+        #independent random streams for each unit, for its ward and for the order its transfers in are accepted
+        randoms = dict((u, numpy.random.RandomState(seed+u)) for u in units)
+        accept_randoms = dict((u, numpy.random.RandomState(seed+len(config)+u)) for u in units)
+        cumulative = dict((u, numpy.cumsum(rates[u])) for u in units)
+        for day in range(1, n_iterations):
+                proposals = dict((j, []) for j in list(connections)+[k])
+                free = {}
+                for u in units:
+                        beds, entry_rate, trans0, trans1, prob_intervention, import_klebs = config[u]
+                        discharge, ST, group, outcomes = states[u]
+                        draws = ward_draws(replicates, 1, beds, entry_rate, los_dist, random=randoms[u])
+                        ward_days(day, day+1, discharge, ST, group, outcomes, draws, trans0, trans1, prob_intervention, import_klebs)
+                        present = discharge > day
+                        free[u] = (~present).sum(1)
+                        #each present patient transfers to at most one destination
+                        if destinations[u]:
+                                choice = numpy.searchsorted(cumulative[u], randoms[u].random_sample(discharge.shape), side="right")
+                                for r, b in zip(*numpy.nonzero(present & (choice < len(destinations[u])))):
+                                        v = destinations[u][choice[r, b]]
+                                        proposals[owner[v]].append((int(r), u, int(b), v, int(discharge[r, b]), int(ST[r, b]), int(group[r, b])))
+                #proposals to units of linked shards, then proposals to units of this shard
+                received = dict((v, []) for v in units)
+                for proposal in proposals[k]+sum(exchange(k, connections, proposals).values(), []):
+                        received[proposal[3]].append(proposal)
+                #transfers accepted in random order while the destination has beds free before today's transfers
+                accepted = dict((j, []) for j in list(connections)+[k])
+                incoming = []
+                for v in units:
+                        unit_proposals = sorted(received[v])
+                        for i in accept_randoms[v].permutation(len(unit_proposals)):
+                                r, u, b, destination, discharge_day, patient_ST, patient_group = unit_proposals[i]
+                                if free[v][r] > 0:
+                                        free[v][r] -= 1
+                                        accepted[owner[u]].append((r, u, b))
+                                        incoming.append((r, v, discharge_day, patient_ST, patient_group))
+                transfers_out = accepted[k]+sum(exchange(k, connections, accepted).values(), [])
+                #remove accepted transfers out, then place transfers in
+                for r, u, b in transfers_out:
+                        states[u][0][r, b] = 0
+                for r, u, discharge_day, patient_ST, patient_group in incoming:
+                        discharge, ST, group, outcomes = states[u]
+                        b = int(numpy.argmax(discharge[r] <= day))
+                        discharge[r, b] = discharge_day
+                        ST[r, b] = patient_ST
+                        group[r, b] = patient_group
+                        transfers_in[u][r] += 1
+                        if patient_ST == 0:
+                                outcomes[r, UNCOLON_ENTRY_0+2*patient_group] += 1
+                                uncolonised_in[u][r, patient_group] += 1
+        connection.send(dict((u, (states[u][3], transfers_in[u], uncolonised_in[u])) for u in units))
+        connection.close()
+
+#Run hospital network, outcomes, transfers in and uncolonised transfers in of each unit
+def hospital(config, destinations, rates, los_dist, n_iterations, replicates, processes, seed):
+        shards = partition([unit[0] for unit in config], processes)
+        owner = {}
+        for k in range(len(shards)):
+                for u in shards[k]:
+                        owner[u] = k
+        #a connection between each pair of shards with a transfer link between their units
+        connections = [{} for k in range(len(shards))]
+        for u in range(len(config)):
+                for v in destinations[u]:
+                        a, b = owner[u], owner[v]
+                        if a != b and b not in connections[a]:
+                                connections[a][b], connections[b][a] = multiprocessing.Pipe()
+        pipes = []
+        workers = []
+        for k in range(len(shards)):
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=shard, args=(k, child, connections[k], owner, shards[k], config, destinations, rates, los_dist, n_iterations, replicates, seed))
+                process.start()
+                pipes.append(parent)
+                workers.append(process)
+        results = {}
+        for parent in pipes:
+                results.update(parent.recv())
+        for process in workers:
+                process.join()
+        return [results[u] for u in range(len(config))]
+
+#Outcome line as printed by intervention_simulation.py, followed by transfers in and unit
+def outcome_line(total, uncolon_0, acquired_0, uncolon_1, acquired_1, transfers_in, unit):
+        proportion = float(acquired_0+acquired_1)/float(uncolon_0+uncolon_1) if uncolon_0+uncolon_1 > 0 else float("nan")
+        return str(total) + "\t" + str(uncolon_0) + "\t" + str(acquired_0)  + "\t" + str(uncolon_1) + "\t" + str(acquired_1) + "\t" + str(uncolon_0+uncolon_1) + "\t" + str(acquired_0+acquired_1) + "\t" + str(proportion) + "\t" + str(transfers_in) + "\t" + str(unit)
+
+if __name__ == "__main__":
+        args = parser.parse_args()
+        n_iterations = int(args.iter)+1
+        replicates = int(args.replicates)
+        seed = int(args.seed) if args.seed != None else numpy.random.randint(2**31-1-10**6)
+        #Process ward file
+        config = []
+        with open(args.wards, 'r') as input_wards:
+                for line in input_wards:
+                        fields = line.split()
+                        if not fields:
+                                continue
+                        if not 4 <= len(fields) <= 6:
+                                raise ValueError("Each line of ward file must give beds, entry rate, trans0, trans1 and optionally prob and importkleb")
+                        values = [float(value) for value in fields] + [0.5, 0.4][len(fields)-4:]
+                        config.append((int(values[0]), int(values[1]), values[2], values[3], values[4], values[5]))
+        #Process sparse transfer file
+        destinations = [[] for u in config]
+        rates = [[] for u in config]
+        if args.transfers != None:
+                with open(args.transfers, 'r') as input_transfers:
+                        for line in input_transfers:
+                                fields = line.split()
+                                if not fields:
+                                        continue
+                                origin, destination, rate = int(fields[0])-1, int(fields[1])-1, float(fields[2])
+                                if origin == destination or not 0 <= origin < len(config) or not 0 <= destination < len(config):
+                                        raise ValueError("Transfers must be between two different units of the ward file")
+                                destinations[origin].append(destination)
+                                rates[origin].append(rate)
+        for u in range(len(config)):
+                if sum(rates[u]) > 1:
+                        raise ValueError("Transfer probabilities out of each unit must sum to at most 1")
+        #Process input lengths of stay
+        los = args.los
+        if los == None:
+                los = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parameters", "neonates.los.NU.txt")
+        los_dist = []
+        with open(los, 'r') as input_los:
+                for line in input_los:
+                        los_dist.append(int(line.split()[0].strip()))
+        results = hospital(config, destinations, rates, los_dist, n_iterations, replicates, int(args.processes), seed)
+        #print column headers, then each unit and hospital total for each replicate
+        print("total_patients" + "\t" + "uncolon_entry_0" + "\t" + "acquired_exit_0" + "\t" + "uncolon_entry_1" + "\t" + "acquired_exit_1" + "\t" + "uncolon_entry_total" + "\t" + "acquired_exit_total" + "\t" + "proportion_acquired_total" + "\t" + "transfers_in" + "\t" + "unit")
+        for r in range(replicates):
+                for u in range(len(config)):
+                        print(outcome_line(*(list(results[u][0][r]) + [results[u][1][r], u+1])))
+                #uncolonised transfers in are counted once in the hospital, at admission to the first unit
+                total = sum(results[u][0][r] for u in range(len(config)))
+                total[UNCOLON_ENTRY_0] -= sum(results[u][2][r, 0] for u in range(len(config)))
+                total[UNCOLON_ENTRY_1] -= sum(results[u][2][r, 1] for u in range(len(config)))
+                print(outcome_line(*(list(total) + [sum(results[u][1][r] for u in range(len(config))), "hospital"])))
@@ -7,7 +7,11 @@ import itertools
 import random
 import numpy
 import sys
+import os
+import zipfile
+import tempfile
 import argparse
+from ward_kernels import blocks, parameter_batch, snapshot_path, ward_state, ward_restore, ward_draws, ward_days
 
 #Argparse
 parser = argparse.ArgumentParser(description="Agent Based Models of AMR introduction and spread in a hospital ward. \n\nAuthor Tom Crellen (tomcrellen@gmail.com) MORU Postdoc. \n \n Model permits interventions (non-time varying)")
@@ -21,6 +25,13 @@ parser.add_argument('-t1','--trans1', default=0.07, required=False, dest="trans1
 parser.add_argument('-p','--prob', default=0.5, required=False, dest="prob_intervention", metavar="", help="Probability that patient is assigned to group 1")
 parser.add_argument('-x', '--importkleb', default=0.4, required=False, dest="import_kleb", metavar="", help="Probability that patient is colonized with K. pneumoniae on admission (imported case) (0.4)")
 parser.add_argument('-r', '--replicates', default=1, required=False, dest="replicates", metavar="", help="number of model runs")
+parser.add_argument('-s', '--snapshots', default=None, required=False, dest="snapshots", metavar="", help="Directory to cache a bank of steady-state ward snapshots, runs start from a sampled snapshot of occupancy and stays instead of an empty ward, colonisation of the snapshot is at import prevalence as there is no transmission during burn-in (off)")
+parser.add_argument('-m', '--engine', default="python", required=False, dest="engine", metavar="", help="[python / array] Simulation engine, python object model or typed array kernel, JIT-compiled with Numba if installed and NumPy otherwise (python)")
+parser.add_argument('-k', '--block', default=100, required=False, dest="block", metavar="", help="Number of replicates advanced together by the array engine (100)")
+parser.add_argument('-f', '--file', default=None, required=False, dest="param_file", metavar="", help="Parameter file evaluated by the array engine, each line is trans0 trans1 and optionally prob and importkleb (replacing -t0 -t1 -p -x), rows are given in the last output column (off)")
+parser.add_argument('-g', '--batch', default=10, required=False, dest="batch", metavar="", help="Number of parameter rows from -f advanced together by the array engine (10)")
+parser.add_argument('--seed', default=None, required=False, dest="seed", metavar="", help="Seed for the random number generator (random)")
+parser.add_argument('-n', '--banksize', default=1000, required=False, dest="banksize", metavar="", help="Number of steady-state snapshots in the bank (1000)")
 
 args = parser.parse_args()
 
@@ -34,6 +45,14 @@ trans1 = float(args.trans1)
 prob_intervention = float(args.prob_intervention)
 import_klebs = float(args.import_kleb)
 model_runs = int(args.replicates)
+snapshot_dir = args.snapshots
+bank_size = int(args.banksize)
+engine = args.engine.lower()
+block_size = int(args.block)
+param_file = args.param_file
+batch_size = int(args.batch)
+if args.seed != None:
+        numpy.random.seed(int(args.seed))
 
 #Process input lengths of stay
 los_dist = []
@@ -65,8 +84,33 @@ class ward:
                 self.colon_exit_0 = 0
                 self.uncolon_entry_1 = 0
                 self.colon_exit_1 = 0
+                #occupied beds and total remaining stay of occupants at the end of each day
+                self.occupancy = []
+                self.remaining_stay = []
 
-        def admit(self):
+        #start from a steady-state snapshot, occupants are treated as admitted on day zero
+        def restore(self, remaining, ST, group):
+                for n in range(len(remaining)):
+                        name = "0."+str(n+1)
+                        self.patients[name] = [0, int(remaining[n]), {}, int(group[n])]
+                        if ST[n] > 0:
+                                self.patients[name][2][int(ST[n])] = ["entry", 0]
+                        elif group[n]==0:
+                                self.uncolon_entry_0 += 1
+                        else:
+                                self.uncolon_entry_1 += 1
+                        self.occupied_beds.append(name)
+                self.empty_beds -= len(remaining)
+
+        #remaining stay, sequence type (0 if uncolonised) and group of patients on the ward after the final day
+        def snapshot(self):
+                day = self.n_iterations-1
+                remaining = [self.patients[name][1]-day for name in self.occupied_beds]
+                ST = [list(self.patients[name][2].keys())[0] if self.patients[name][2] else 0 for name in self.occupied_beds]
+                group = [self.patients[name][3] for name in self.occupied_beds]
+                return remaining, ST, group
+
+        def admit(self, output=True):
                 #For each day (iteration)
                 for day in range(self.n_iterations):
                         #after day zero
@@ -153,14 +197,154 @@ class ward:
                                                                 self.patients[klebs_uncolon_1[j]][2][numpy.random.choice(klebs_colonised_ST)] = ["PMA", day]
                                                         #update outcome variable
                                                         self.colon_exit_1 += len(klebs_PMA_index_1)
+                        self.occupancy.append(len(self.occupied_beds))
+                        self.remaining_stay.append(sum(self.patients[name][1]-day for name in self.occupied_beds))
 
                 #print output to command line
-                print(str(len(self.patients)) + "\t" + str(self.uncolon_entry_0) + "\t" + str(self.colon_exit_0)  + "\t" + str(self.uncolon_entry_1) + "\t" + str(self.colon_exit_1) + "\t" + str(self.uncolon_entry_0+self.uncolon_entry_1) + "\t" + str(self.colon_exit_0+self.colon_exit_1) + "\t" + str(float(self.colon_exit_0+self.colon_exit_1)/float(self.uncolon_entry_0+self.uncolon_entry_1)))
+                if output:
+                        print(str(len(self.patients)) + "\t" + str(self.uncolon_entry_0) + "\t" + str(self.colon_exit_0)  + "\t" + str(self.uncolon_entry_1) + "\t" + str(self.colon_exit_1) + "\t" + str(self.uncolon_entry_0+self.uncolon_entry_1) + "\t" + str(self.colon_exit_0+self.colon_exit_1) + "\t" + str(float(self.colon_exit_0+self.colon_exit_1)/float(self.uncolon_entry_0+self.uncolon_entry_1)))
                         
 
+#Number of days for an empty ward to reach steady state, from pilot runs without transmission
+#occupancy settles within a few days, so the burn-in is the first day the mean remaining stay of occupants is also
+#within tolerance of steady state, and at least the longest stay so no occupant was admitted before the ward filled
+def burn_in_length(entry_rate, beds, los_dist, pilots=100, tolerance=0.02):
+        horizon = 4*int(max(los_dist))+1
+        occupancy = numpy.zeros(horizon)
+        remaining_stay = numpy.zeros(horizon)
+        for i in range(pilots):
+                pilot = ward(n_iterations=horizon, entry_rate=entry_rate, beds=beds, los_dist=los_dist, trans0=0, trans1=0, import_klebs=0)
+                pilot.admit(output=False)
+                occupancy += pilot.occupancy
+                remaining_stay += pilot.remaining_stay
+        mean_stay = remaining_stay/numpy.maximum(occupancy, 1)
+        steady_occupancy = occupancy[horizon//2:].mean()
+        steady_stay = remaining_stay[horizon//2:].sum()/occupancy[horizon//2:].sum()
+        occupied = int(numpy.argmax(occupancy >= (1-tolerance)*steady_occupancy))
+        settled = int(numpy.argmax(mean_stay >= (1-tolerance)*steady_stay))
+        return max(int(max(los_dist)), occupied, settled)
+
+#Bank of steady-state ward snapshots for a given configuration, generated once and cached on disk
+#snapshots are stored as flat arrays, occupants of snapshot k are offsets[k]:offsets[k+1]
+#the burn-in runs have no transmission, so colonisation of the snapshots is at import prevalence (-x)
+def snapshot_bank(directory, entry_rate, beds, los_dist, prob_intervention, import_klebs, size):
+        path = snapshot_path(directory, entry_rate, beds, los_dist, prob_intervention, import_klebs, size)
+        #a bank that cannot be read (for instance left by a run that was killed) is generated again
+        if os.path.exists(path):
+                try:
+                        if zipfile.is_zipfile(path):
+                                bank = numpy.load(path)
+                                return int(bank["burn_in"]), bank["offsets"], bank["remaining"], bank["ST"], bank["group"]
+                except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+                        pass
+                sys.stderr.write("snapshot bank " + path + " could not be read, generating it again\n")
+        burn_in = burn_in_length(entry_rate, beds, los_dist)
+        offsets = [0]
+        remaining = []
+        ST = []
+        group = []
+        for i in range(size):
+                burn = ward(n_iterations=burn_in+1, entry_rate=entry_rate, beds=beds, los_dist=los_dist, trans0=0, trans1=0, prob_intervention=prob_intervention, import_klebs=import_klebs)
+                burn.admit(output=False)
+                r, st, g = burn.snapshot()
+                remaining += r
+                ST += st
+                group += g
+                offsets.append(len(remaining))
+        try:
+                os.makedirs(directory)
+        except OSError:
+                if not os.path.isdir(directory):
+                        raise
+        #written to a temporary file in the same directory and renamed into place, so runs sharing the directory never
+        #read a partly written bank
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix=".ward_snapshots_", suffix=".npz")
+        try:
+                with os.fdopen(handle, "wb") as output:
+                        numpy.savez_compressed(output, burn_in=burn_in, offsets=offsets, remaining=remaining, ST=ST, group=group)
+                os.rename(temporary, path)
+        except:
+                os.remove(temporary)
+                raise
+        return burn_in, numpy.array(offsets), numpy.array(remaining), numpy.array(ST), numpy.array(group)
+
+#load or generate snapshot bank
+if snapshot_dir != None:
+        burn_in, offsets, remaining, ST, group = snapshot_bank(snapshot_dir, entry_rate, beds, los_dist, prob_intervention, import_klebs, bank_size)
+
+#Start replicates first..first+n-1 of array engine state from randomly sampled steady-state snapshots
+def restore_block(discharge, ST_state, group_state, outcomes, first, n, random=numpy.random):
+        for r in range(first, first+n):
+                k = random.randint(len(offsets)-1)
+                ward_restore(discharge, ST_state, group_state, outcomes, r, remaining[offsets[k]:offsets[k+1]], ST[offsets[k]:offsets[k+1]], group[offsets[k]:offsets[k+1]])
+
+#print outcomes of array engine replicates, optionally followed by parameter row, proportion acquired is nan without uncolonised entries
+def print_outcomes(outcomes, row=None):
+        for total, uncolon_0, acquired_0, uncolon_1, acquired_1 in outcomes:
+                proportion = float(acquired_0+acquired_1)/float(uncolon_0+uncolon_1) if uncolon_0+uncolon_1 > 0 else float("nan")
+                line = str(total) + "\t" + str(uncolon_0) + "\t" + str(acquired_0)  + "\t" + str(uncolon_1) + "\t" + str(acquired_1) + "\t" + str(uncolon_0+uncolon_1) + "\t" + str(acquired_0+acquired_1) + "\t" + str(proportion)
+                if row != None:
+                        line += "\t" + str(row)
+                print(line)
+
+#Process parameter file
+param_rows = []
+if param_file != None:
+        if engine != "array":
+                raise ValueError("Parameter file requires array engine")
+        with open(param_file, 'r') as input_params:
+                for line in input_params:
+                        if line.strip():
+                                param_rows.append([float(value) for value in line.split()])
+        if snapshot_dir != None and max(len(row) for row in param_rows) > 2:
+                raise ValueError("Snapshot bank is for a single -p and -x, parameter file must only give trans0 trans1")
+
 #print column headers
-print("total_patients" + "\t" + "uncolon_entry_0" + "\t" + "acquired_exit_0" + "\t" + "uncolon_entry_1" + "\t" + "acquired_exit_1" + "\t" + "uncolon_entry_total" + "\t" + "acquired_exit_total" + "\t" + "proportion_acquired_total")
+print("total_patients" + "\t" + "uncolon_entry_0" + "\t" + "acquired_exit_0" + "\t" + "uncolon_entry_1" + "\t" + "acquired_exit_1" + "\t" + "uncolon_entry_total" + "\t" + "acquired_exit_total" + "\t" + "proportion_acquired_total" + ("\t" + "row" if param_file != None else ""))
+#days advanced per array engine call, random numbers are drawn for one chunk at a time so memory does not grow with -i
+chunk_days = 30
 #run model
-for i in range(model_runs):
-        run=ward()
-        run.admit()
+if param_file != None:
+        #batches of parameter rows share one array engine run, replicates of each row are contiguous
+        #each row has its own random stream, with --seed row i is seeded with seed+i and matches a separate array engine run
+        #with that seed (if -k >= -r)
+        for start in range(0, len(param_rows), batch_size):
+                batch = param_rows[start:start+batch_size]
+                batch_discharge, batch_ST, batch_group, outcomes = ward_state(len(batch)*model_runs, beds)
+                streams = [numpy.random.RandomState(int(args.seed)+start+i if args.seed != None else None) for i in range(len(batch))]
+                if snapshot_dir != None:
+                        for i in range(len(batch)):
+                                restore_block(batch_discharge, batch_ST, batch_group, outcomes, i*model_runs, model_runs, streams[i])
+                batch_trans0 = parameter_batch([row[0] for row in batch], model_runs)
+                batch_trans1 = parameter_batch([row[1] for row in batch], model_runs)
+                batch_prob = parameter_batch([row[2] if len(row) > 2 else prob_intervention for row in batch], model_runs)
+                batch_import = parameter_batch([row[3] if len(row) > 3 else import_klebs for row in batch], model_runs)
+                for first in range(1, n_iterations, chunk_days):
+                        last = min(first+chunk_days, n_iterations)
+                        draws = [ward_draws(model_runs, last-first, beds, entry_rate, los_dist, random=stream) for stream in streams]
+                        draws = [numpy.concatenate(draw) for draw in zip(*draws)]
+                        ward_days(first, last, batch_discharge, batch_ST, batch_group, outcomes, draws, batch_trans0, batch_trans1, batch_prob, batch_import)
+                for i in range(len(batch)):
+                        print_outcomes(outcomes[i*model_runs:(i+1)*model_runs], start+i+1)
+elif engine == "array":
+        #whole blocks of replicates run inside the array kernel, from a random stream of their own as in the parameter file batches
+        stream = numpy.random.RandomState(int(args.seed) if args.seed != None else None)
+        for block in blocks(model_runs, block_size):
+                block_discharge, block_ST, block_group, outcomes = ward_state(block, beds)
+                if snapshot_dir != None:
+                        restore_block(block_discharge, block_ST, block_group, outcomes, 0, block, stream)
+                for first in range(1, n_iterations, chunk_days):
+                        last = min(first+chunk_days, n_iterations)
+                        draws = ward_draws(block, last-first, beds, entry_rate, los_dist, random=stream)
+                        ward_days(first, last, block_discharge, block_ST, block_group, outcomes, draws, trans0, trans1, prob_intervention, import_klebs)
+                print_outcomes(outcomes)
+elif engine == "python":
+        for i in range(model_runs):
+                run=ward()
+                #start from a randomly sampled steady-state snapshot
+                if snapshot_dir != None:
+                        k = numpy.random.randint(len(offsets)-1)
+                        run.restore(remaining[offsets[k]:offsets[k+1]], ST[offsets[k]:offsets[k+1]], group[offsets[k]:offsets[k+1]])
+                run.admit()
+else:
+        raise ValueError("Engine must be python or array")
@@ -0,0 +1,120 @@
+#Particle filter (sequential Monte Carlo) estimate of the log-likelihood of daily ward prevalence data under the ward model
+#Particles are array engine ward states, advanced in lockstep through the observed days and copied by index when resampled
+#The log-likelihood estimate is unbiased on the natural scale, so it can be used for particle-MCMC fitting
+
+import os
+import math
+import numpy
+import argparse
+from ward_kernels import snapshot_path, ward_state, ward_restore, ward_draws, ward_days
+
+#Argparse
+parser = argparse.ArgumentParser(description="Particle filter log-likelihood of daily ward prevalence data (time,S,I,N as printed by old_scripts/ward-transmission-ABM.py) under the model in intervention_simulation.py")
+parser.add_argument('-d', '--data', default=None, required=True, dest="data", metavar="", help="Path to observed data, each line is day, uncolonised (S), colonised (I) and total (N) patients, comma or whitespace separated, header lines are skipped. N is only used as the binomial sample size of I, the ward occupancy of particles is not fitted to it")
+parser.add_argument('-l', '--lengthofstay', default=None, required=False, dest="los", metavar="", help="Path to file where each line is length of stay in days (parameters/neonates.los.NU.txt)")
+parser.add_argument('-b', '--beds', default=8, required=False, dest="beds", metavar="", help="Number of beds in ward (8)")
+parser.add_argument('-e', '--entryrate', default=3, required=False, dest="entry", metavar="", help="Entry rate of patients per day, Poisson rate parameter (3)")
+parser.add_argument('-t0','--trans0', default=0.02, required=False, dest="trans0", metavar="", help="Probability of person-to-person transmission of K. pneumoniae in group 0 (0.02)")
+parser.add_argument('-t1','--trans1', default=0.07, required=False, dest="trans1", metavar="", help="Probability of person-to-person transmission of K. pneumoniae in group 1 (0.07)")
+parser.add_argument('-p','--prob', default=0.5, required=False, dest="prob_intervention", metavar="", help="Probability that patient is assigned to group 1 (0.5)")
+parser.add_argument('-x', '--importkleb', default=0.4, required=False, dest="import_kleb", metavar="", help="Probability that patient is colonized with K. pneumoniae on admission (imported case) (0.4)")
+parser.add_argument('-n', '--particles', default=1000, required=False, dest="particles", metavar="", help="Number of particles (1000)")
+parser.add_argument('-E', '--epsilon', default=0.01, required=False, dest="epsilon", metavar="", help="Observed colonised patients are binomial with the particle prevalence, bounded in [epsilon, 1-epsilon] (0.01)")
+parser.add_argument('-R', '--resample', default=0.5, required=False, dest="resample", metavar="", help="Resample when effective sample size falls below this fraction of particles (0.5)")
+parser.add_argument('-s', '--snapshots', default=None, required=False, dest="snapshots", metavar="", help="Directory of the steady-state snapshot bank of intervention_simulation.py -s for the same -b -e -l -p -x, particles start from sampled snapshots instead of an empty ward (off)")
+parser.add_argument('-S', '--banksize', default=1000, required=False, dest="banksize", metavar="", help="Number of snapshots in the bank, as -n of intervention_simulation.py (1000)")
+parser.add_argument('--seed', default=None, required=False, dest="seed", metavar="", help="Seed for the random number generator (random)")
+
+#Observed days and counts from time,S,I,N file
+def read_observations(path):
+        days = []
+        colonised = []
+        total = []
+        with open(path, 'r') as input_data:
+                for line in input_data:
+                        fields = line.replace(",", " ").split()
+                        try:
+                                day, S, I, N = [int(float(value)) for value in fields[:4]]
+                        except ValueError:
+                                continue
+                        days.append(day)
+                        colonised.append(I)
+                        total.append(N)
+        return numpy.array(days), numpy.array(colonised), numpy.array(total)
+
+#Log of binomial probability of k colonised out of n observed, for particle prevalences
+def binomial_log_weights(k, n, prevalence):
+        return math.lgamma(n+1)-math.lgamma(k+1)-math.lgamma(n-k+1) + k*numpy.log(prevalence) + (n-k)*numpy.log(1-prevalence)
+
+#Systematic resampling, indices of particles to copy
+def systematic_resample(weights):
+        n = len(weights)
+        positions = (numpy.random.random()+numpy.arange(n))/n
+        cumulative = numpy.cumsum(weights)
+        cumulative[-1] = 1.0
+        return numpy.searchsorted(cumulative, positions)
+
+#Particle filter estimate of log-likelihood of observed days, particles start on day zero from an empty ward, or from
+#snapshots (offsets, remaining, ST, group) sampled from a bank of steady-state snapshots
+def log_likelihood(days, colonised, total, particles, beds, entry_rate, los_dist, trans0, trans1, prob_intervention, import_klebs, epsilon=0.01, resample=0.5, snapshots=None):
+        discharge, ST, group, outcomes = ward_state(particles, beds)
+        if snapshots != None:
+                offsets, remaining, snapshot_ST, snapshot_group = snapshots
+                for r in range(particles):
+                        k = numpy.random.randint(len(offsets)-1)
+                        ward_restore(discharge, ST, group, outcomes, r, remaining[offsets[k]:offsets[k+1]], snapshot_ST[offsets[k]:offsets[k+1]], snapshot_group[offsets[k]:offsets[k+1]])
+        log_weights = numpy.zeros(particles)
+        loglik = 0.0
+        day = 0
+        for t in range(len(days)):
+                #advance all particles in lockstep to the next observed day
+                if days[t] > day:
+                        draws = ward_draws(particles, days[t]-day, beds, entry_rate, los_dist)
+                        ward_days(day+1, days[t]+1, discharge, ST, group, outcomes, draws, trans0, trans1, prob_intervention, import_klebs)
+                        day = days[t]
+                #weight particles against observed colonised count
+                present = discharge > day
+                n_present = present.sum(1)
+                n_colonised = (present & (ST > 0)).sum(1)
+                prevalence = numpy.clip(n_colonised/numpy.maximum(n_present, 1.0), epsilon, 1-epsilon)
+                step = binomial_log_weights(colonised[t], total[t], prevalence)
+                #increment of log-likelihood is log of weighted mean of observation probabilities
+                normalised = numpy.exp(log_weights-log_weights.max())
+                normalised /= normalised.sum()
+                top = step.max()
+                loglik += top + numpy.log(numpy.sum(normalised*numpy.exp(step-top)))
+                log_weights += step
+                weights = numpy.exp(log_weights-log_weights.max())
+                weights /= weights.sum()
+                #copy particle states by index if effective sample size is low
+                if 1.0/numpy.sum(weights**2) < resample*particles:
+                        index = systematic_resample(weights)
+                        discharge, ST, group, outcomes = discharge[index], ST[index], group[index], outcomes[index]
+                        log_weights = numpy.zeros(particles)
+        return loglik
+
+if __name__ == "__main__":
+        args = parser.parse_args()
+        if args.seed != None:
+                numpy.random.seed(int(args.seed))
+        los = args.los
+        if los == None:
+                los = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parameters", "neonates.los.NU.txt")
+        los_dist = []
+        with open(los, 'r') as input_los:
+                for line in input_los:
+                        los_dist.append(int(line.split()[0].strip()))
+        days, colonised, total = read_observations(args.data)
+        if len(days) == 0:
+                raise ValueError("No observations in data file")
+        if numpy.any(numpy.diff(days) <= 0):
+                raise ValueError("Observed days must be increasing")
+        #load snapshot bank cached by intervention_simulation.py
+        snapshots = None
+        if args.snapshots != None:
+                path = snapshot_path(args.snapshots, int(args.entry), int(args.beds), los_dist, float(args.prob_intervention), float(args.import_kleb), int(args.banksize))
+                if not os.path.exists(path):
+                        raise ValueError("No snapshot bank for these options in " + args.snapshots + ", generate it with: python intervention_simulation.py -r 0 -s " + args.snapshots + " -b " + str(args.beds) + " -e " + str(args.entry) + " -l " + los + " -p " + str(args.prob_intervention) + " -x " + str(args.import_kleb) + " -n " + str(args.banksize))
+                bank = numpy.load(path)
+                snapshots = (bank["offsets"], bank["remaining"], bank["ST"], bank["group"])
+        print(log_likelihood(days, colonised, total, int(args.particles), int(args.beds), int(args.entry), los_dist, float(args.trans0), float(args.trans1), float(args.prob_intervention), float(args.import_kleb), float(args.epsilon), float(args.resample), snapshots))
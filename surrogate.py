@@ -0,0 +1,197 @@
+#Surrogate emulator of intervention_simulation.py for instant intervention scenario queries
+#Training runs the simulator (array engine) over a Latin hypercube design of the varied inputs, and fits Gaussian process
+#emulators of the mean and spread (standard deviation) of proportion_acquired_total, saved to a .npz file
+#Queries predict mean and spread with emulator uncertainty, and flag inputs outside the trained region
+
+import os
+import sys
+import numpy
+import tempfile
+import argparse
+import subprocess
+
+#inputs of intervention_simulation.py that can be emulated, with default fixed values
+INPUTS = ["t0", "t1", "p", "x"]
+DEFAULTS = {"t0": 0.02, "t1": 0.07, "p": 0.5, "x": 0.4}
+
+#Argparse
+parser = argparse.ArgumentParser(description="Surrogate emulator of proportion_acquired_total from intervention_simulation.py. Train over a Latin hypercube design of the varied inputs, then answer scenario queries with uncertainty")
+parser.add_argument('mode', metavar="<mode>", help="[train / query]")
+parser.add_argument('-m', '--model', default="surrogate.npz", required=False, dest="model", metavar="", help="Path of saved emulator (surrogate.npz)")
+parser.add_argument('-v', '--vary', default=[], required=False, dest="vary", nargs=3, action="append", metavar=("NAME", "LOW", "HIGH"), help="Input varied in training (t0, t1, p or x) and its range, repeat for each input (train)")
+parser.add_argument('-t0','--trans0', default=None, required=False, dest="t0", metavar="", help="Fixed value of -t0 if not varied (0.02, or rows of -f)")
+parser.add_argument('-t1','--trans1', default=None, required=False, dest="t1", metavar="", help="Fixed value of -t1 if not varied (0.07, or rows of -f)")
+parser.add_argument('-p','--prob', default=None, required=False, dest="p", metavar="", help="Fixed value of -p if not varied (0.5)")
+parser.add_argument('-x', '--importkleb', default=None, required=False, dest="x", metavar="", help="Fixed value of -x if not varied (0.4)")
+parser.add_argument('-f', '--file', default=None, required=False, dest="file", metavar="", help="Posterior file of trans0 trans1, rows are sampled for each design point unless -t0 and -t1 are varied or fixed (train)")
+parser.add_argument('-N', '--design', default=50, required=False, dest="design", metavar="", help="Number of design points (50)")
+parser.add_argument('-s', '--rows', default=20, required=False, dest="rows", metavar="", help="Number of posterior rows per design point (20)")
+parser.add_argument('-r', '--replicates', default=5, required=False, dest="replicates", metavar="", help="Number of replicates per posterior row (5)")
+parser.add_argument('-a', '--simargs', default="", required=False, dest="simargs", metavar="", help="Other options passed to intervention_simulation.py, such as \"-b 9 -e 3\" (train)")
+parser.add_argument('--python', default=sys.executable, required=False, dest="python", metavar="", help="Python interpreter used to run intervention_simulation.py (this interpreter)")
+parser.add_argument('-q', '--query', default=[], required=False, dest="query", action="append", metavar="NAME=VALUE[,NAME=VALUE]", help="Scenario of varied inputs, repeat for several scenarios (query)")
+parser.add_argument('--seed', default=None, required=False, dest="seed", metavar="", help="Seed for the random number generator (random)")
+
+#Latin hypercube sample of n points in the unit cube of given dimension
+def latin_hypercube(n, dimension):
+        sample = numpy.zeros((n, dimension))
+        for j in range(dimension):
+                sample[:, j] = (numpy.random.permutation(n)+numpy.random.random(n))/n
+        return sample
+
+#Squared exponential covariance between rows of A and B
+def covariance(A, B, lengths):
+        return numpy.exp(-0.5*numpy.sum(((A[:, None, :]-B[None, :, :])/lengths)**2, axis=2))
+
+#Gaussian process fit to y with known noise variances, length scales chosen by coordinate search on the marginal likelihood
+def fit_gp(X, y, noise, grid=numpy.exp(numpy.linspace(numpy.log(0.05), numpy.log(5.0), 15)), passes=3):
+        centre = y.mean()
+        scale = y.std() if y.std() > 0 else 1.0
+        z = (y-centre)/scale
+        nugget = noise/scale**2 + 1e-8
+
+        def marginal(lengths):
+                K = covariance(X, X, lengths)+numpy.diag(nugget)
+                try:
+                        L = numpy.linalg.cholesky(K)
+                except numpy.linalg.LinAlgError:
+                        return -numpy.inf
+                alpha = numpy.linalg.solve(L.T, numpy.linalg.solve(L, z))
+                return -0.5*numpy.dot(z, alpha)-numpy.sum(numpy.log(numpy.diag(L)))
+
+        lengths = numpy.ones(X.shape[1])*0.5
+        for i in range(passes):
+                for j in range(X.shape[1]):
+                        scores = []
+                        for value in grid:
+                                trial = lengths.copy()
+                                trial[j] = value
+                                scores.append(marginal(trial))
+                        lengths[j] = grid[int(numpy.argmax(scores))]
+        K = covariance(X, X, lengths)+numpy.diag(nugget)
+        L = numpy.linalg.cholesky(K)
+        alpha = numpy.linalg.solve(L.T, numpy.linalg.solve(L, z))
+        return centre, scale, lengths, alpha, L
+
+#Gaussian process prediction, mean and standard deviation at rows of Q
+def predict_gp(X, Q, centre, scale, lengths, alpha, L):
+        k = covariance(Q, X, lengths)
+        v = numpy.linalg.solve(L, k.T)
+        mean = centre+scale*numpy.dot(k, alpha)
+        sd = scale*numpy.sqrt(numpy.clip(1.0-numpy.sum(v**2, axis=0), 0, None))
+        return mean, sd
+
+#Run intervention_simulation.py once over all design points, proportion_acquired_total of each replicate
+def simulate(points, names, fixed, posterior, n_rows, replicates, simargs, python):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intervention_simulation.py")
+        lines = []
+        for point in points:
+                values = dict(zip(names, point))
+                for i in range(n_rows):
+                        row = posterior[numpy.random.randint(len(posterior))] if posterior != None else None
+                        line = []
+                        for column, name in enumerate(INPUTS):
+                                #varied value, else fixed value, else posterior row (t0 and t1 only), else default
+                                if name in values:
+                                        line.append(values[name])
+                                elif fixed[name] != None:
+                                        line.append(fixed[name])
+                                elif row != None and column < 2:
+                                        line.append(row[column])
+                                else:
+                                        line.append(DEFAULTS[name])
+                        lines.append(line)
+        handle, path = tempfile.mkstemp(suffix=".txt")
+        try:
+                with os.fdopen(handle, "w") as rows_file:
+                        for line in lines:
+                                rows_file.write(" ".join(repr(float(value)) for value in line) + "\n")
+                command = [python, script, "-m", "array", "-f", path, "-r", str(replicates), "-g", str(max(1, 1000//replicates)), "--seed", str(numpy.random.randint(2**31-1))] + simargs.split()
+                output = subprocess.check_output(command).decode()
+        finally:
+                os.remove(path)
+        #outcomes of each design point, one row per posterior row
+        outcomes = numpy.zeros((len(points), n_rows, replicates))
+        counts = numpy.zeros((len(points), n_rows), dtype=int)
+        for line in output.splitlines()[1:]:
+                fields = line.split()
+                point, row = divmod(int(fields[8])-1, n_rows)
+                outcomes[point, row, counts[point, row]] = float(fields[7])
+                counts[point, row] += 1
+        return outcomes
+
+#Train emulators over Latin hypercube design and save to path
+def train(path, vary, fixed, posterior, n_design, n_rows, replicates, simargs, python):
+        names = [name for name, low, high in vary]
+        low = numpy.array([low for name, low, high in vary])
+        high = numpy.array([high for name, low, high in vary])
+        X = latin_hypercube(n_design, len(names))
+        outcomes = simulate(low+X*(high-low), names, fixed, posterior, n_rows, replicates, simargs, python)
+        #replicates without uncolonised entries have no proportion acquired (nan) and are left out
+        samples = numpy.ma.masked_invalid(outcomes)
+        flat = samples.reshape(n_design, -1)
+        n_valid = flat.count(1)
+        if numpy.any(n_valid < 2):
+                raise ValueError("Fewer than two replicates with uncolonised entries at " + str(numpy.sum(n_valid < 2)) + " design points, narrow the design ranges or increase the replicates")
+        mean = flat.mean(1).filled()
+        sd = flat.std(1, ddof=1).filled()
+        #noise variances of the Monte Carlo estimates of mean (replicates are clustered within posterior rows) and standard deviation
+        row_means = samples.mean(2)
+        if n_rows > 1 and numpy.all(row_means.count(1) > 1):
+                mean_noise = (row_means.var(1, ddof=1)/row_means.count(1)).filled()
+        else:
+                mean_noise = sd**2/n_valid
+        mean_fit = fit_gp(X, mean, mean_noise)
+        sd_fit = fit_gp(X, sd, sd**2/(2*(n_valid-1)))
+        numpy.savez(path, names=numpy.array(names), low=low, high=high, X=X,
+                mean_centre=mean_fit[0], mean_scale=mean_fit[1], mean_lengths=mean_fit[2], mean_alpha=mean_fit[3], mean_L=mean_fit[4],
+                sd_centre=sd_fit[0], sd_scale=sd_fit[1], sd_lengths=sd_fit[2], sd_alpha=sd_fit[3], sd_L=sd_fit[4])
+
+#Predicted mean, spread and emulator standard deviation of proportion_acquired_total for scenarios, and whether inside trained region
+def query(path, scenarios):
+        model = numpy.load(path)
+        names = [str(name) for name in model["names"]]
+        low = model["low"]
+        high = model["high"]
+        for scenario in scenarios:
+                if sorted(scenario.keys()) != sorted(names):
+                        raise ValueError("Scenario must give a value for each trained input: " + ", ".join(names))
+        values = numpy.array([[scenario[name] for name in names] for scenario in scenarios], dtype=float)
+        Q = (values-low)/(high-low)
+        inside = numpy.all((Q >= 0) & (Q <= 1), axis=1)
+        mean, mean_sd = predict_gp(model["X"], Q, model["mean_centre"], model["mean_scale"], model["mean_lengths"], model["mean_alpha"], model["mean_L"])
+        sd, sd_sd = predict_gp(model["X"], Q, model["sd_centre"], model["sd_scale"], model["sd_lengths"], model["sd_alpha"], model["sd_L"])
+        return mean, numpy.clip(sd, 0, None), mean_sd, inside
+
+if __name__ == "__main__":
+        args = parser.parse_args()
+        if args.seed != None:
+                numpy.random.seed(int(args.seed))
+        mode = args.mode.lower()
+        if mode == "train":
+                vary = [(name, float(low), float(high)) for name, low, high in args.vary]
+                if not vary:
+                        parser.error("train requires at least one --vary input")
+                for name, low, high in vary:
+                        if name not in INPUTS or not high > low:
+                                raise ValueError("Varied input must be t0, t1, p or x with HIGH > LOW")
+                fixed = dict((name, None if getattr(args, name) == None else float(getattr(args, name))) for name in INPUTS)
+                posterior = None
+                if args.file != None:
+                        with open(args.file, 'r') as input_rows:
+                                posterior = [[float(value) for value in line.split()[:2]] for line in input_rows if line.strip()]
+                train(args.model, vary, fixed, posterior, int(args.design), int(args.rows), int(args.replicates), args.simargs, args.python)
+        elif mode == "query":
+                scenarios = []
+                for scenario in args.query:
+                        scenarios.append(dict((item.split("=")[0].strip(), float(item.split("=")[1])) for item in scenario.split(",")))
+                if not scenarios:
+                        parser.error("query requires at least one --query scenario")
+                mean, sd, mean_sd, inside = query(args.model, scenarios)
+                print("mean" + "\t" + "sd" + "\t" + "emulator_sd" + "\t" + "in_trained_region")
+                for i in range(len(scenarios)):
+                        print(str(mean[i]) + "\t" + str(sd[i]) + "\t" + str(mean_sd[i]) + "\t" + str(bool(inside[i])))
+                        if not inside[i]:
+                                sys.stderr.write("warning: scenario " + str(i+1) + " is outside the trained region, prediction is an extrapolation\n")
+        else:
+                raise ValueError("Mode must be train or query")
@@ -0,0 +1,259 @@
+#Distribute parameter sweeps of the ward models over many nodes
+#The coordinator serves (parameter row, replicate block, seed) tasks over a plain socket, workers on any node
+#run the simulation command for each task and push back the reduced result (sum and count of the outcome column)
+
+import os
+import sys
+import hmac
+import json
+import time
+import shlex
+import socket
+import argparse
+import binascii
+import threading
+import subprocess
+from ward_kernels import blocks
+
+try:
+        import socketserver
+except ImportError:
+        import SocketServer as socketserver
+
+#Argparse
+parser = argparse.ArgumentParser(description="Distributed parameter sweeps of the ward models. A coordinator serves tasks to workers on any node and merges the results into a single ordered output, with one mean per parameter row (as the bash loops in README.md)")
+parser.add_argument('mode', metavar="<mode>", help="[coordinator / worker]")
+parser.add_argument('-c', '--command', default=None, required=False, dest="command", metavar="", help="Simulation command (coordinator), {0}, {1}.. are replaced with the columns of each parameter row, {replicates} with the replicates and {seed} with the seed of each task")
+parser.add_argument('-f', '--file', default=None, required=False, dest="file", metavar="", help="Parameter file, one parameter set per line (coordinator)")
+parser.add_argument('-r', '--replicates', default=100, required=False, dest="replicates", metavar="", help="Number of replicates per parameter row (100)")
+parser.add_argument('-k', '--block', default=25, required=False, dest="block", metavar="", help="Number of replicates per task (25)")
+parser.add_argument('-C', '--column', default=8, required=False, dest="column", metavar="", help="Column of the simulation output averaged over replicates, lines that are not numbers are skipped (8, proportion_acquired_total)")
+parser.add_argument('-s', '--seed', default=1, required=False, dest="seed", metavar="", help="Seed of the first task, each task has its own seed so results do not depend on which worker runs it (1)")
+parser.add_argument('-H', '--host', default="localhost", required=False, dest="host", metavar="", help="Address the coordinator listens on, 0.0.0.0 for all interfaces when workers run on other nodes, or the worker connects to (localhost)")
+parser.add_argument('-P', '--port', default=5000, required=False, dest="port", metavar="", help="Port of the coordinator (5000)")
+parser.add_argument('-T', '--token', default=os.environ.get("SWEEP_TOKEN"), required=False, dest="token", metavar="", help="Shared secret sent with every message and checked by the coordinator, the coordinator generates and prints one if not given (SWEEP_TOKEN environment variable)")
+parser.add_argument('-t', '--timeout', default=600, required=False, dest="timeout", metavar="", help="Seconds before the task of a lost worker is reissued (600)")
+parser.add_argument('-R', '--retries', default=3, required=False, dest="retries", metavar="", help="Number of times a task may fail before the sweep is stopped with the failing command (3)")
+parser.add_argument('-w', '--workers', default=0, required=False, dest="workers", metavar="", help="Number of local workers started with the coordinator (0)")
+parser.add_argument('-o', '--output', default=None, required=False, dest="output", metavar="", help="Path of results file (standard output)")
+
+#Queue of sweep tasks, leased to workers and reissued if not returned within timeout or if the command fails
+class sweep:
+        def __init__(self, rows, command, replicates, block_size, seed, timeout, retries=3):
+                self.rows = rows
+                self.command = command
+                self.timeout = timeout
+                self.retries = retries
+                #task is [row index, replicates, seed]
+                self.tasks = []
+                for i in range(len(rows)):
+                        for block in blocks(replicates, block_size):
+                                self.tasks.append([i, block, seed+len(self.tasks)])
+                self.pending = list(range(len(self.tasks)))
+                self.leased = {}
+                self.results = {}
+                self.failures = {}
+                #command and error of a task that failed more than retries times, stops the sweep
+                self.failed = None
+                self.lock = threading.Lock()
+                self.finished = threading.Event()
+                if not self.tasks:
+                        self.finished.set()
+
+        #next task for a worker
+        def get(self):
+                with self.lock:
+                        if self.finished.is_set():
+                                return {"op": "done"}
+                        #reissue tasks of lost workers
+                        now = time.time()
+                        for task, leased in list(self.leased.items()):
+                                if now-leased > self.timeout:
+                                        del self.leased[task]
+                                        self.pending.append(task)
+                        if not self.pending:
+                                return {"op": "wait"}
+                        task = self.pending.pop(0)
+                        self.leased[task] = now
+                        return {"op": "task", "task": task, "command": self.task_command(task)}
+
+        #simulation command of a task
+        def task_command(self, task):
+                i, replicates, seed = self.tasks[task]
+                return self.command.format(*self.rows[i], replicates=replicates, seed=seed)
+
+        #reduced result from a worker, duplicates from reissued tasks are ignored
+        def put(self, task, total, count):
+                with self.lock:
+                        if task in self.results:
+                                return
+                        self.results[task] = (total, count)
+                        self.leased.pop(task, None)
+                        if task in self.pending:
+                                self.pending.remove(task)
+                        sys.stderr.write("completed " + str(len(self.results)) + "/" + str(len(self.tasks)) + " tasks\n")
+                        if len(self.results) == len(self.tasks):
+                                self.finished.set()
+
+        #failed simulation command from a worker, the task is reissued until it has failed more than retries times
+        def fail(self, task, error):
+                with self.lock:
+                        if task in self.results or self.finished.is_set():
+                                return
+                        self.leased.pop(task, None)
+                        self.failures[task] = self.failures.get(task, 0)+1
+                        sys.stderr.write("task " + str(task) + " failed (" + str(self.failures[task]) + "/" + str(self.retries+1) + "): " + error + "\n")
+                        if self.failures[task] > self.retries:
+                                self.failed = (self.task_command(task), error)
+                                self.finished.set()
+                        elif task not in self.pending:
+                                self.pending.append(task)
+
+        #mean of outcome for each parameter row, in the order of the parameter file
+        def merge(self):
+                totals = [0.0]*len(self.rows)
+                counts = [0]*len(self.rows)
+                for task, (total, count) in self.results.items():
+                        totals[self.tasks[task][0]] += total
+                        counts[self.tasks[task][0]] += count
+                return [totals[i]/counts[i] if counts[i] > 0 else float("nan") for i in range(len(self.rows))]
+
+#One request per connection, messages are lines of JSON, messages without the shared token are rejected
+class handler(socketserver.StreamRequestHandler):
+        def handle(self):
+                try:
+                        message = json.loads(self.rfile.readline().decode())
+                        authorised = hmac.compare_digest(str(message.get("token")), self.server.token)
+                except (ValueError, TypeError, AttributeError):
+                        authorised = False
+                if not authorised:
+                        reply = {"op": "error"}
+                elif message["op"] == "get":
+                        reply = self.server.sweep.get()
+                elif message["op"] == "put":
+                        self.server.sweep.put(message["task"], message["total"], message["count"])
+                        reply = {"op": "ok"}
+                elif message["op"] == "fail":
+                        self.server.sweep.fail(message["task"], message["error"])
+                        reply = {"op": "ok"}
+                else:
+                        reply = {"op": "error"}
+                self.wfile.write((json.dumps(reply)+"\n").encode())
+
+class server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+#Send message with the shared token to coordinator and return reply
+def request(host, port, token, message):
+        message["token"] = token
+        connection = socket.create_connection((host, port))
+        try:
+                connection.sendall((json.dumps(message)+"\n").encode())
+                return json.loads(connection.makefile("rb").readline().decode())
+        finally:
+                connection.close()
+
+#Run simulation command and reduce output to sum and count of outcome column
+def run(command, column):
+        total = 0.0
+        count = 0
+        output = subprocess.check_output(shlex.split(command)).decode()
+        for line in output.splitlines():
+                try:
+                        value = float(line.split()[column-1])
+                except (IndexError, ValueError):
+                        continue
+                total += value
+                count += 1
+        return total, count
+
+#Pull tasks until the sweep is finished, a failed simulation command is reported to the coordinator
+def worker(host, port, token, column, timeout=30):
+        connected = False
+        start = time.time()
+        while True:
+                try:
+                        reply = request(host, port, token, {"op": "get"})
+                except socket.error:
+                        #coordinator not started yet, or shut down after the sweep finished
+                        if not connected and time.time()-start < timeout:
+                                time.sleep(1)
+                                continue
+                        break
+                connected = True
+                if reply["op"] == "done":
+                        break
+                elif reply["op"] == "error":
+                        sys.stderr.write("worker rejected by coordinator, check --token\n")
+                        break
+                elif reply["op"] == "wait":
+                        time.sleep(1)
+                elif reply["op"] == "task":
+                        try:
+                                total, count = run(reply["command"], column)
+                                message = {"op": "put", "task": reply["task"], "total": total, "count": count}
+                        except (subprocess.CalledProcessError, OSError) as error:
+                                message = {"op": "fail", "task": reply["task"], "error": str(error)}
+                        try:
+                                request(host, port, token, message)
+                        except socket.error:
+                                #coordinator shut down, the result is no longer needed
+                                break
+
+#Serve tasks until all results are returned, then write merged results, exits with status 1 if a task failed too often
+def coordinator(tasks, host, port, token, n_workers, column, output):
+        tcp = server((host, port), handler)
+        tcp.sweep = tasks
+        tcp.token = str(token)
+        thread = threading.Thread(target=tcp.serve_forever)
+        thread.daemon = True
+        thread.start()
+        #local workers on this node, the token is passed in the environment rather than on the command line
+        environment = dict(os.environ, SWEEP_TOKEN=token)
+        local = [subprocess.Popen([sys.executable, __file__, "worker", "-H", "localhost", "-P", str(tcp.server_address[1]), "-C", str(column)], close_fds=True, env=environment) for n in range(n_workers)]
+        while not tasks.finished.wait(1):
+                pass
+        if tasks.failed != None:
+                tcp.shutdown()
+                tcp.server_close()
+                for process in local:
+                        process.wait()
+                command, error = tasks.failed
+                sys.stderr.write("sweep stopped, task failed " + str(tasks.retries+1) + " times: " + command + "\n" + error + "\n")
+                sys.exit(1)
+        means = tasks.merge()
+        out = open(output, "w") if output != None else sys.stdout
+        for mean in means:
+                out.write(str(mean) + "\n")
+        if output != None:
+                out.close()
+        #remaining workers exit when the coordinator is gone
+        tcp.shutdown()
+        tcp.server_close()
+        for process in local:
+                process.wait()
+
+if __name__ == "__main__":
+        args = parser.parse_args()
+        mode = args.mode.lower()
+        port = int(args.port)
+        column = int(args.column)
+        if mode == "coordinator":
+                if args.command == None or args.file == None:
+                        parser.error("coordinator requires --command and --file")
+                rows = []
+                with open(args.file, 'r') as input_rows:
+                        for line in input_rows:
+                                if line.strip():
+                                        rows.append(line.split())
+                tasks = sweep(rows, args.command, int(args.replicates), int(args.block), int(args.seed), float(args.timeout), int(args.retries))
+                token = args.token
+                if token == None:
+                        token = binascii.hexlify(os.urandom(16)).decode()
+                        sys.stderr.write("sweep token: " + token + "\n")
+                coordinator(tasks, args.host, port, token, int(args.workers), column, args.output)
+        elif mode == "worker":
+                worker(args.host, port, args.token, column)
+        else:
+                raise ValueError("Mode must be coordinator or worker")
@@ -0,0 +1,222 @@
+#Typed array kernels for the daily steps of the ward models (discharge, capacity-capped admission, transmission)
+#Kernels are JIT-compiled with Numba if installed, otherwise an equivalent NumPy implementation is used
+#Random numbers are drawn up front with numpy.random and passed to the kernels, so under the same seed both
+#implementations give identical results
+
+import os
+import numpy
+import hashlib
+
+try:
+        import numba
+except ImportError:
+        numba = None
+
+#use compiled kernels when Numba is available
+JIT = numba is not None
+
+#outcome columns of the ward kernel, matching the output of intervention_simulation.py
+TOTAL, UNCOLON_ENTRY_0, ACQUIRED_EXIT_0, UNCOLON_ENTRY_1, ACQUIRED_EXIT_1 = range(5)
+
+#Split replicates into blocks of at most block_size
+def blocks(replicates, block_size):
+        return [min(block_size, replicates-start) for start in range(0, replicates, block_size)]
+
+#Broadcast a scalar or per-replicate parameter to a float array of length replicates
+def per_replicate(value, replicates):
+        return numpy.ascontiguousarray(numpy.broadcast_to(numpy.asarray(value, dtype=float), (replicates,)))
+
+#Per-replicate parameters for a batch of parameter sets, the replicates of each set are contiguous
+def parameter_batch(values, replicates):
+        return numpy.repeat(numpy.asarray(values, dtype=float), replicates)
+
+## WARD MODEL (intervention_simulation.py) ##
+
+#Empty ward state for a block of replicates, discharge day (empty if <= day), sequence type (0 uncolonised) and group
+def ward_state(replicates, beds):
+        discharge = numpy.zeros((replicates, beds), dtype=numpy.int64)
+        ST = numpy.zeros((replicates, beds), dtype=numpy.int64)
+        group = numpy.zeros((replicates, beds), dtype=numpy.int64)
+        outcomes = numpy.zeros((replicates, 5), dtype=numpy.int64)
+        return discharge, ST, group, outcomes
+
+#Path of the cached bank of steady-state ward snapshots for a given configuration (see intervention_simulation.py)
+#first element of the key is the version of the burn-in rule, so banks cached under an earlier rule are not reused
+def snapshot_path(directory, entry_rate, beds, los_dist, prob_intervention, import_klebs, size):
+        key = hashlib.md5(str([2, entry_rate, beds, sorted(los_dist), prob_intervention, import_klebs, size]).encode()).hexdigest()
+        return os.path.join(directory, "ward_snapshots_"+key+".npz")
+
+#Place a steady-state snapshot (remaining stays, sequence types, groups) in replicate r, occupants are admitted on day zero
+def ward_restore(discharge, ST, group, outcomes, r, remaining, snapshot_ST, snapshot_group):
+        n = len(remaining)
+        discharge[r, :n] = remaining
+        ST[r, :n] = snapshot_ST
+        group[r, :n] = snapshot_group
+        uncolonised = numpy.asarray(snapshot_ST) == 0
+        outcomes[r, TOTAL] += n
+        outcomes[r, UNCOLON_ENTRY_0] += numpy.sum(uncolonised & (numpy.asarray(snapshot_group) == 0))
+        outcomes[r, UNCOLON_ENTRY_1] += numpy.sum(uncolonised & (numpy.asarray(snapshot_group) == 1))
+
+#Random numbers for n_days of a block of ward replicates, admission draws are indexed by admission slot on each day
+#random is the global numpy.random state, or a numpy.random.RandomState for an independent stream
+def ward_draws(replicates, n_days, beds, entry_rate, los_dist, random=numpy.random):
+        new_patients = random.poisson(entry_rate, (replicates, n_days)).astype(numpy.int64)
+        los = random.choice(numpy.asarray(los_dist, dtype=numpy.int64), (replicates, n_days, beds))
+        entry = random.random_sample((replicates, n_days, beds))
+        entry_ST = random.randint(1, 301, (replicates, n_days, beds)).astype(numpy.int64)
+        entry_group = random.random_sample((replicates, n_days, beds))
+        infect = random.random_sample((replicates, n_days, beds))
+        source = random.random_sample((replicates, n_days, beds))
+        return new_patients, los, entry, entry_ST, entry_group, infect, source
+
+#Advance ward state in place over days first..last-1, one replicate at a time (compiled with Numba)
+def _ward_days_loop(first, last, discharge, ST, group, outcomes, new_patients, los, entry, entry_ST, entry_group, infect, source, trans0, trans1, p_group, import_klebs):
+        replicates, beds = discharge.shape
+        colonised_ST = numpy.zeros(beds, dtype=numpy.int64)
+        for r in range(replicates):
+                for day in range(first, last):
+                        d = day-first
+                        #discharge patients and admit new patients into empty beds, capped at number of empty beds
+                        k = 0
+                        for b in range(beds):
+                                if discharge[r, b] <= day and k < new_patients[r, d]:
+                                        discharge[r, b] = day+los[r, d, k]
+                                        g = 1 if entry_group[r, d, k] < p_group[r] else 0
+                                        group[r, b] = g
+                                        outcomes[r, TOTAL] += 1
+                                        if entry[r, d, k] < import_klebs[r]:
+                                                ST[r, b] = entry_ST[r, d, k]
+                                        else:
+                                                ST[r, b] = 0
+                                                outcomes[r, UNCOLON_ENTRY_0+2*g] += 1
+                                        k += 1
+                        #sequence types of colonised patients present on the ward, in bed order
+                        n_col = 0
+                        for b in range(beds):
+                                if discharge[r, b] > day and ST[r, b] > 0:
+                                        colonised_ST[n_col] = ST[r, b]
+                                        n_col += 1
+                        #pseudo mass action transmission to uncolonised patients
+                        if n_col > 0:
+                                for b in range(beds):
+                                        if discharge[r, b] > day and ST[r, b] == 0:
+                                                t = trans1[r] if group[r, b] == 1 else trans0[r]
+                                                if infect[r, d, b] < 1.0-(1.0-t)**float(n_col):
+                                                        ST[r, b] = colonised_ST[int(source[r, d, b]*n_col)]
+                                                        outcomes[r, ACQUIRED_EXIT_0+2*group[r, b]] += 1
+
+#Advance ward state in place over days first..last-1, vectorised over replicates and beds
+def _ward_days_numpy(first, last, discharge, ST, group, outcomes, new_patients, los, entry, entry_ST, entry_group, infect, source, trans0, trans1, p_group, import_klebs):
+        replicates, beds = discharge.shape
+        rows = numpy.arange(replicates)[:, None]
+        for day in range(first, last):
+                d = day-first
+                #discharge patients and admit new patients into empty beds, capped at number of empty beds
+                empty = discharge <= day
+                slot = numpy.cumsum(empty, 1)-1
+                admitted = empty & (slot < new_patients[:, d][:, None])
+                slot = numpy.where(admitted, slot, 0)
+                imported = entry[:, d][rows, slot] < import_klebs[:, None]
+                g = (entry_group[:, d][rows, slot] < p_group[:, None]).astype(numpy.int64)
+                discharge[...] = numpy.where(admitted, day+los[:, d][rows, slot], discharge)
+                ST[...] = numpy.where(admitted, numpy.where(imported, entry_ST[:, d][rows, slot], 0), ST)
+                group[...] = numpy.where(admitted, g, group)
+                outcomes[:, TOTAL] += admitted.sum(1)
+                outcomes[:, UNCOLON_ENTRY_0] += (admitted & ~imported & (g == 0)).sum(1)
+                outcomes[:, UNCOLON_ENTRY_1] += (admitted & ~imported & (g == 1)).sum(1)
+                #sequence types of colonised patients present on the ward, in bed order
+                present = discharge > day
+                colonised = present & (ST > 0)
+                n_col = colonised.sum(1)
+                colonised_ST = ST[rows, numpy.argsort(~colonised, axis=1, kind="mergesort")]
+                #pseudo mass action transmission to uncolonised patients
+                t = numpy.where(group == 1, trans1[:, None], trans0[:, None])
+                acquired = present & (ST == 0) & (infect[:, d] < 1.0-(1.0-t)**n_col[:, None].astype(float))
+                source_ST = colonised_ST[rows, (source[:, d]*n_col[:, None]).astype(numpy.int64)]
+                ST[...] = numpy.where(acquired, source_ST, ST)
+                outcomes[:, ACQUIRED_EXIT_0] += (acquired & (group == 0)).sum(1)
+                outcomes[:, ACQUIRED_EXIT_1] += (acquired & (group == 1)).sum(1)
+
+#Advance a block of ward replicates in place over days first..last-1
+def ward_days(first, last, discharge, ST, group, outcomes, draws, trans0, trans1, p_group, import_klebs, jit=None):
+        replicates = discharge.shape[0]
+        params = [per_replicate(value, replicates) for value in (trans0, trans1, p_group, import_klebs)]
+        kernel = _ward_days_jit if (JIT if jit is None else jit) else _ward_days_numpy
+        kernel(first, last, discharge, ST, group, outcomes, *(list(draws)+params))
+
+## RA MODEL (RA_simulation.py) ##
+
+#Random numbers for n_days of a block of RA replicates, stay lengths of the initial patients in each bed and of patients
+#admitted to each bed on each day
+def R0_draws(replicates, n_days, n_beds, stay_distribution):
+        initial = numpy.random.choice(numpy.asarray(stay_distribution, dtype=float), (replicates, n_beds)).astype(numpy.int64)
+        stay = numpy.random.choice(numpy.asarray(stay_distribution, dtype=float), (replicates, n_days, n_beds)).astype(numpy.int64)
+        infect = numpy.random.random((replicates, n_days, n_beds))
+        return initial, stay, infect
+
+#Number of infected beds each day for a block of replicates (-1 after the outbreak ends), one replicate at a time (compiled with Numba)
+def _R0_loop(initial, stay, infect, risk, n_infected):
+        replicates, n_days, n_beds = stay.shape
+        infected = numpy.zeros(n_beds, dtype=numpy.int64)
+        discharge = numpy.zeros(n_beds, dtype=numpy.int64)
+        for r in range(replicates):
+                #populate the ward, index case in first bed
+                for b in range(n_beds):
+                        infected[b] = 0
+                        discharge[b] = initial[r, b]
+                infected[0] = 1
+                for day in range(n_days):
+                        n_inf = 0
+                        for b in range(n_beds):
+                                n_inf += infected[b]
+                        #transmission, each uninfected bed has n_inf independent chances of infection
+                        if day != 0:
+                                p = 1.0-(1.0-risk)**float(n_inf)
+                                for b in range(n_beds):
+                                        if infected[b] == 0 and infect[r, day, b] < p:
+                                                infected[b] = 1
+                                n_inf = 0
+                                for b in range(n_beds):
+                                        n_inf += infected[b]
+                        n_infected[r, day] = n_inf
+                        #terminate if no more infected patients
+                        if n_inf == 0:
+                                break
+                        #discharged patients replaced by uninfected patients
+                        for b in range(n_beds):
+                                if discharge[b] <= day:
+                                        infected[b] = 0
+                                        discharge[b] = stay[r, day, b]+day
+
+#Number of infected beds each day for a block of replicates (-1 after the outbreak ends), vectorised over replicates and beds
+def _R0_numpy(initial, stay, infect, risk, n_infected):
+        replicates, n_days, n_beds = stay.shape
+        infected = numpy.zeros((replicates, n_beds), dtype=bool)
+        infected[:, 0] = True
+        discharge = initial.copy()
+        running = numpy.ones(replicates, dtype=bool)
+        for day in range(n_days):
+                #transmission, each uninfected bed has n_inf independent chances of infection
+                if day != 0:
+                        p = 1.0-(1.0-risk)**infected.sum(1).astype(float)
+                        infected |= infect[:, day] < p[:, None]
+                n_inf = infected.sum(1)
+                n_infected[running, day] = n_inf[running]
+                #terminate if no more infected patients
+                running &= n_inf > 0
+                #discharged patients replaced by uninfected patients
+                discharged = discharge <= day
+                infected &= ~discharged
+                discharge[...] = numpy.where(discharged, stay[:, day]+day, discharge)
+
+#Number of infected beds each day for a block of RA replicates, -1 after the outbreak ends
+def R0_days(draws, risk, jit=None):
+        initial, stay, infect = draws
+        n_infected = numpy.full(stay.shape[:2], -1, dtype=numpy.int64)
+        kernel = _R0_jit if (JIT if jit is None else jit) else _R0_numpy
+        kernel(initial, stay, infect, float(risk), n_infected)
+        return n_infected
+
+if JIT:
+        _ward_days_jit = numba.njit(cache=True)(_ward_days_loop)
+        _R0_jit = numba.njit(cache=True)(_R0_loop)